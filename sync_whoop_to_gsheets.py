@@ -1,17 +1,28 @@
 import base64
+import functools
+import json
 import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import click
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta, timezone, date
 from whoop_auth import start_auth_web_server, get_valid_whoop_token
-import requests
+import httpx
+import re
 import time
 import random
 
+# orjson decodes the nested WHOOP payloads several times faster than stdlib
+# json; fall back silently when it is not installed.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 logging.basicConfig(level=logging.INFO, force=True)
 
 load_dotenv()
@@ -19,6 +30,14 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Shared HTTP/2 client so paginated (and concurrent) WHOOP requests multiplex
+# over a single TCP/TLS connection instead of handshaking per page.
+_HTTP = httpx.Client(http2=True, timeout=30)
+
+class UnrecoverableError(Exception):
+    """Error that retrying cannot fix (e.g. a 4xx from a bad request)"""
+    pass
+
 def retry_with_backoff(max_retries=3, base_delay=1, max_delay=60):
     """Decorator for retrying functions with exponential backoff"""
     def decorator(func):
@@ -26,6 +45,8 @@ def retry_with_backoff(max_retries=3, base_delay=1, max_delay=60):
             for attempt in range(max_retries + 1):
                 try:
                     return func(*args, **kwargs)
+                except UnrecoverableError:
+                    raise
                 except Exception as e:
                     if attempt == max_retries:
                         logger.error(f"Failed after {max_retries} retries: {e}")
@@ -47,181 +68,350 @@ def main(ctx):
         ctx.invoke(sync)
 
 
+@functools.lru_cache(maxsize=64)
+def _tz_from_offset(offset_str):
+    """Build a timezone from a '+HH:MM' offset string, cached per unique offset."""
+    sign = 1 if offset_str[0] == '+' else -1
+    hours, minutes = map(int, offset_str[1:].split(':'))
+    return timezone(timedelta(hours=hours, minutes=minutes) * sign)
+
 def parse_whoop_local_datetime(dt_str, timezone_offset):
     dt_utc = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-    
+
     # Handle empty or None timezone_offset
     if not timezone_offset or timezone_offset.strip() == '':
         logger.warning(f"Empty timezone_offset encountered, defaulting to UTC. dt_str: {dt_str}")
         return dt_utc
-    
+
     # Normalize the timezone offset string
     timezone_offset = timezone_offset.strip()
-    
+
     # Handle 'Z' which means UTC
     if timezone_offset == 'Z':
         return dt_utc
-    
+
     # Validate format: should start with + or -
     if not (timezone_offset.startswith('+') or timezone_offset.startswith('-')):
         logger.warning(f"Invalid timezone_offset format '{timezone_offset}', defaulting to UTC. dt_str: {dt_str}")
         return dt_utc
-    
+
+    # UTC offset means no conversion is needed at all
+    if timezone_offset in ('+00:00', '-00:00'):
+        return dt_utc
+
     try:
-        sign = 1 if timezone_offset[0] == '+' else -1
-        hours, minutes = map(int, timezone_offset[1:].split(':'))
-        offset = timedelta(hours=hours, minutes=minutes) * sign
-        local_tz = timezone(offset)
+        local_tz = _tz_from_offset(timezone_offset)
         return dt_utc.astimezone(local_tz)
     except (ValueError, IndexError) as e:
         logger.warning(f"Error parsing timezone_offset '{timezone_offset}': {e}. Defaulting to UTC. dt_str: {dt_str}")
         return dt_utc
 
+RUNNING_SPORT_IDS = {0}
+
+# Per-sheet timestamp of the last successful sync, so repeat runs only fetch
+# the window since then instead of the full --days-ago range.
+SYNC_STATE_FILE = '.whoop-sync-state.json'
+
+def _load_last_sync(sheet_name):
+    """Return the datetime of the last successful sync for a sheet, or None."""
+    try:
+        with open(SYNC_STATE_FILE) as f:
+            state = json.load(f)
+        ts = state.get(str(sheet_name))
+        return datetime.fromisoformat(ts) if ts else None
+    except (OSError, ValueError):
+        return None
+
+def _save_last_sync(sheet_name, sync_time):
+    """Record a successful sync time for a sheet in the state file."""
+    try:
+        with open(SYNC_STATE_FILE) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state[str(sheet_name)] = sync_time.isoformat()
+    with open(SYNC_STATE_FILE, 'w') as f:
+        json.dump(state, f, indent=2)
+
+# Matches week-start cells in DD/MM/YY form (the ISO form is detected by shape)
+_DMY_RE = re.compile(r'^\d{2}/\d{2}/\d{2}$')
+
+# English day names indexed by date.weekday(); unlike strftime('%A') this is
+# locale-independent, so the day_columns lookup works under any locale
+_DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+def _monday_of(d):
+    """Return the Monday of the week containing date d."""
+    return d - timedelta(days=d.weekday())
+
+def _day_name(d):
+    """Return the English day name for date d."""
+    return _DAYS[d.weekday()]
+
 def get_running_activities_with_token(access_token, start_date, end_date):
     logger.info(f"Fetching workouts from {start_date} to {end_date} using OAuth token")
     base_url = "https://api.prod.whoop.com/developer/v2/activity/workout"
     headers = {"Authorization": f"Bearer {access_token}"}
-    params = {"start": start_date, "end": end_date, "limit": 25}
-    all_workouts = []
-    page_count = 0
 
-    while True:
-        page_count += 1
-        logger.info(f"Requesting page {page_count} with params: {params}")
-        resp = requests.get(base_url, headers=headers, params=params)
-        if resp.status_code != 200:
+    @retry_with_backoff(max_retries=3, base_delay=1, max_delay=30)
+    def _fetch_page(params):
+        """Fetch one page of workouts with retry on transient failures"""
+        resp = _HTTP.get(base_url, headers=headers, params=params)
+        if resp.status_code == 200:
+            return _json_loads(resp.content)
+        if resp.status_code == 429:
+            # Honour the server's Retry-After before the decorator's backoff
+            retry_after = resp.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    time.sleep(min(float(retry_after), 30))
+                except ValueError:
+                    pass
+            raise Exception(f"Rate limited fetching workouts: {resp.status_code} {resp.text}")
+        if resp.status_code >= 500 or resp.status_code == 408:
             raise Exception(f"Failed to fetch workouts: {resp.status_code} {resp.text}")
-        data = resp.json()
-        workouts = data.get("records", [])
-        logger.info(f"Fetched {len(workouts)} records on page {page_count}")
-        if workouts:
-            ids = [w.get('id') for w in workouts]
-            logger.info(f"Record IDs on page {page_count}: {ids}")
-        all_workouts.extend(workouts)
-
-        # Check for next_token in the response (WHOOP API uses 'next_token' field)
-        next_token = data.get("next_token")
-        if not next_token:
-            logger.info(f"No more pages available. Completed pagination after {page_count} page(s)")
-            break
-
-        # Update params for next request using 'nextToken' parameter (WHOOP API specification)
-        params["nextToken"] = next_token
-        logger.info(f"Added pagination token for next request: {next_token}")
-
-        # Safety check to prevent infinite loops
-        if page_count > 100:  # Reasonable upper limit
-            logger.warning(f"Reached maximum page limit ({page_count}). Stopping pagination to prevent infinite loop.")
-            break
-
-    logger.info(f"Fetched {len(all_workouts)} workouts from WHOOP across {page_count} page(s)")
-    running_per_day = {}
-
-    # Track unique workout IDs during processing
-    seen_workout_ids = set()
-    
-    RUNNING_SPORT_IDS = {0}
-    for w in all_workouts:
-        workout_id = w.get('id')
-        if not workout_id:
-            logger.warning(f"Skipping workout with missing ID: {w}")
-            continue
-        if workout_id in seen_workout_ids:
-            logger.warning(f"Skipping duplicate workout ID: {workout_id}")
-            continue
-        if w.get('sport_id') not in RUNNING_SPORT_IDS:
-            continue
-            
-        start_dt = parse_whoop_local_datetime(w['start'], w.get('timezone_offset', '+00:00'))
-        end_dt = parse_whoop_local_datetime(w['end'], w.get('timezone_offset', '+00:00'))
-        duration_min = int((end_dt - start_dt).total_seconds() / 60)
+        # Other 4xx responses will not succeed on retry
+        raise UnrecoverableError(f"Failed to fetch workouts: {resp.status_code} {resp.text}")
+
+    def _fetch_range(range_start, range_end):
+        """Follow next_token pagination for one date slice, returning its records"""
+        params = {"start": range_start, "end": range_end, "limit": 25}
+        records = []
+        page_count = 0
+        while True:
+            page_count += 1
+            logger.debug("Requesting page %d with params: %s", page_count, params)
+            data = _fetch_page(params)
+            workouts = data.get("records", [])
+            logger.debug("Fetched %d records on page %d", len(workouts), page_count)
+            if workouts and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Record IDs on page %d: %s", page_count, [w.get('id') for w in workouts])
+            records.extend(workouts)
+
+            # Check for next_token in the response (WHOOP API uses 'next_token' field)
+            next_token = data.get("next_token")
+            if not next_token:
+                break
+
+            # Update params for next request using 'nextToken' parameter (WHOOP API specification)
+            params["nextToken"] = next_token
+            logger.debug("Added pagination token for next request: %s", next_token)
+
+            # Safety check to prevent infinite loops
+            if page_count > 100:  # Reasonable upper limit
+                logger.warning("Reached maximum page limit (%d). Stopping pagination to prevent infinite loop.", page_count)
+                break
+        logger.info("Fetched %d record(s) across %d page(s) for %s to %s",
+                    len(records), page_count, range_start, range_end)
+        return records
+
+    # Shard the date range into up to 4 slices and fetch them concurrently,
+    # since each slice's next_token chain is otherwise strictly serial. Any
+    # workout landing on a slice boundary is caught by the ID de-dupe below.
+    range_start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+    range_end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+    num_slices = min(4, max(1, (range_end_dt - range_start_dt).days))
+    slice_len = (range_end_dt - range_start_dt) / num_slices
+    fmt = '%Y-%m-%dT%H:%M:%S.000Z'
+    slices = [
+        ((range_start_dt + slice_len * i).strftime(fmt),
+         (range_start_dt + slice_len * (i + 1)).strftime(fmt))
+        for i in range(num_slices)
+    ]
+
+    all_workouts = []
+    if num_slices == 1:
+        all_workouts = _fetch_range(start_date, end_date)
+    else:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for records in executor.map(lambda s: _fetch_range(*s), slices):
+                all_workouts.extend(records)
+
+    logger.info("Fetched %d workouts from WHOOP across %d slice(s)", len(all_workouts), num_slices)
+
+    # Filter first, then process: keep only running workouts with an ID, and
+    # de-dupe by ID (last occurrence wins) before doing any datetime work.
+    running = [w for w in all_workouts if w.get('sport_id') in RUNNING_SPORT_IDS and w.get('id')]
+    unique_running = list({w['id']: w for w in running}.values())
+    skipped = len(all_workouts) - len(running)
+    duplicates = len(running) - len(unique_running)
+    if skipped:
+        logger.info("Skipped %d non-running or ID-less workout(s)", skipped)
+    if duplicates:
+        logger.warning("Skipped %d duplicate workout ID(s)", duplicates)
+
+    running_per_day = defaultdict(int)
+    log_info = logger.isEnabledFor(logging.INFO)
+    for w in unique_running:
+        # Duration is timezone-invariant, so compute it straight from the UTC
+        # timestamps; only the start needs localizing to pick the right date.
+        start_utc = datetime.fromisoformat(w['start'].replace('Z', '+00:00'))
+        end_utc = datetime.fromisoformat(w['end'].replace('Z', '+00:00'))
+        # Pure integer arithmetic; avoids the float round-trip of total_seconds()
+        delta = end_utc - start_utc
+        duration_min = delta.days * 1440 + delta.seconds // 60
+        workout_date = parse_whoop_local_datetime(w['start'], w.get('timezone_offset', '+00:00')).date()
         if duration_min == 0:
-            logger.warning(f"Workout {w.get('id')} on {start_dt.date()} has 0 duration!")
-        workout_date = start_dt.date()
+            logger.warning("Workout %s on %s has 0 duration!", w['id'], workout_date)
 
-        logger.info(f"Found running workout on {workout_date}: {duration_min} min")
-        if workout_date not in running_per_day:
-            running_per_day[workout_date] = 0
         running_per_day[workout_date] += duration_min
-        logger.info(f"Total running minutes for {workout_date}: {running_per_day[workout_date]}")
-        
-        # Add to seen IDs after successful processing
-        seen_workout_ids.add(workout_id)
+        if log_info:
+            logger.info("Found running workout on %s: %d min (total %d)",
+                        workout_date, duration_min, running_per_day[workout_date])
+
+    logger.info("Aggregated running minutes for %d day(s)", len(running_per_day))
+    return dict(running_per_day)
+
+# Caches so repeated syncs in one process reuse the authorized client (and
+# its HTTP session) and skip the Drive lookup that gc.open() performs.
+_creds_info_cache = {}
+_gc_cache = {}
+_sheet_cache = {}
+_sheets_service_cache = {}
 
-    logger.info(f"Aggregated running minutes for {len(running_per_day)} day(s)")
-    return running_per_day
+def _load_creds_info(creds_path):
+    """Read and parse the service-account key file, cached per path."""
+    info = _creds_info_cache.get(creds_path)
+    if info is None:
+        with open(creds_path) as f:
+            info = json.load(f)
+        _creds_info_cache[creds_path] = info
+    return info
+
+def _get_gspread_client(creds_path):
+    """Return a gspread client for the given credentials, cached per path."""
+    # Imported here so commands that never touch Sheets (auth, upload-tokens)
+    # skip the slow gspread/google-auth/cryptography import chain at startup
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    gc = _gc_cache.get(creds_path)
+    if gc is None:
+        logger.info(f"Authenticating with Google Sheets using creds at {creds_path}")
+        scopes = [
+            'https://www.googleapis.com/auth/spreadsheets',
+            'https://www.googleapis.com/auth/drive'
+        ]
+        creds = Credentials.from_service_account_info(_load_creds_info(creds_path), scopes=scopes)
+        gc = gspread.authorize(creds)
+        _gc_cache[creds_path] = gc
+    return gc
+
+def _get_sheets_service(creds_path):
+    """Return a Sheets API service for the given credentials, cached per path."""
+    from googleapiclient.discovery import build
+    from google.oauth2.service_account import Credentials
+
+    service = _sheets_service_cache.get(creds_path)
+    if service is None:
+        creds = Credentials.from_service_account_info(
+            _load_creds_info(creds_path),
+            scopes=['https://www.googleapis.com/auth/spreadsheets'],
+        )
+        service = build('sheets', 'v4', credentials=creds, cache_discovery=False)
+        _sheets_service_cache[creds_path] = service
+    return service
+
+def _open_sheet(creds_path, sheet_name):
+    """Open a spreadsheet by name, cached per (creds_path, sheet_name)."""
+    sh = _sheet_cache.get((creds_path, sheet_name))
+    if sh is None:
+        gc = _get_gspread_client(creds_path)
+        logger.info(f"Opening Google Sheet: {sheet_name}")
+        sh = gc.open(sheet_name)
+        _sheet_cache[(creds_path, sheet_name)] = sh
+    return sh
 
 def update_running_sheet(sheet_name, creds_path, running_per_day):
-    logger.info(f"Authenticating with Google Sheets using creds at {creds_path}")
-    scopes = [
-        'https://www.googleapis.com/auth/spreadsheets',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    gc = gspread.authorize(creds)
-    logger.info(f"Opening Google Sheet: {sheet_name}")
-    sh = gc.open(sheet_name)
+    import gspread
+
+    sh = _open_sheet(creds_path, sheet_name)
     worksheet = sh.worksheet('Running')
     logger.info(f"Accessed 'Running' worksheet")
 
-    all_values = worksheet.get_all_values()
-    if not all_values:
+    # Only fetch the header row and the week-start date column instead of
+    # every cell in the sheet - the rest of the grid is never read.
+    header_rows, date_col = worksheet.batch_get(['1:1', 'A2:A'])
+    if not header_rows:
         logger.error('Running sheet is empty!')
-        return 0
-    headers = all_values[0]
+        return None
+    headers = header_rows[0]
     day_columns = {day.strip(): idx for idx, day in enumerate(headers) if day.strip().lower() in ['monday','tuesday','wednesday','thursday','friday','saturday','sunday']}
     if not day_columns:
         logger.error('No day-of-week columns found in Running sheet!')
-        return 0
-
-    def get_monday(date):
-        if isinstance(date, str):
-            d = datetime.strptime(date, '%Y-%m-%d').date()
-        else:
-            d = date  # already a date object
-        return d - timedelta(days=d.weekday())
-    def get_day_name(date):
-        if isinstance(date, str):
-            d = datetime.strptime(date, '%Y-%m-%d').date()
-        else:
-            d = date  # already a date object
-        return d.strftime('%A')
+        return None
 
     week_row_map = {}
-    for i, row in enumerate(all_values[1:], start=2):
-        for cell in row:
-            try:
-                # Try both formats: YYYY-MM-DD and DD/MM/YY
-                try:
-                    week_monday = datetime.strptime(cell, '%Y-%m-%d').date()
-                except ValueError:
-                    week_monday = datetime.strptime(cell, '%d/%m/%y').date()
-                week_row_map[week_monday] = i
-                break
-            except Exception:
+    for i, row in enumerate(date_col, start=2):
+        if not row:
+            continue
+        cell = row[0]
+        # Cheap shape checks pick the format up front instead of letting
+        # strptime raise on every non-matching cell
+        try:
+            if len(cell) == 10 and cell[4] == '-':
+                week_monday = date.fromisoformat(cell)
+            elif _DMY_RE.match(cell):
+                week_monday = datetime.strptime(cell, '%d/%m/%y').date()
+            else:
                 continue
+        except ValueError:
+            continue
+        week_row_map[week_monday] = i
 
     @retry_with_backoff(max_retries=3, base_delay=2, max_delay=30)
-    def update_single_cell(row_idx, col_idx, minutes):
-        """Update a single cell with retry logic"""
-        worksheet.update_cell(row_idx, col_idx+1, minutes)
-
-    updates = 0
-    for date, minutes in running_per_day.items():
-        week_monday = get_monday(date)
-        day_name = get_day_name(date)
+    def apply_batch_update(payload):
+        """Write all changed cells in a single values.batchUpdate call with retry logic"""
+        service = _get_sheets_service(creds_path)
+        body = {
+            'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': f"Running!{entry['range']}", 'values': entry['values']} for entry in payload],
+        }
+        service.spreadsheets().values().batchUpdate(spreadsheetId=sh.id, body=body).execute()
+
+    payload = []
+    unmapped = 0
+    for day, minutes in running_per_day.items():
+        week_monday = _monday_of(day)
+        day_name = _day_name(day)
         row_idx = week_row_map.get(week_monday)
         col_idx = day_columns.get(day_name)
         if row_idx and col_idx is not None:
             if minutes > 0:
-                logger.info(f"Updating {date} ({day_name}) in week {week_monday}: {minutes} min")
-                update_single_cell(row_idx, col_idx, minutes)
-                updates += 1
+                logger.info("Updating %s (%s) in week %s: %d min", day, day_name, week_monday, minutes)
+                payload.append({
+                    'range': gspread.utils.rowcol_to_a1(row_idx, col_idx + 1),
+                    'values': [[minutes]],
+                })
             else:
-                logger.info(f"Skipping update for {date} ({day_name}) in week {week_monday}: 0 min (cell left blank)")
+                logger.info("Skipping update for %s (%s) in week %s: 0 min (cell left blank)", day, day_name, week_monday)
         else:
-            logger.error(f"Could not find cell for {date} ({day_name}) in week starting {week_monday}")
+            logger.error("Could not find cell for %s (%s) in week starting %s", day, day_name, week_monday)
+            unmapped += 1
+
+    if payload:
+        # Writes count against the Sheets quota even when the value is
+        # unchanged, so read the target cells back and drop no-op updates.
+        existing = worksheet.batch_get([entry['range'] for entry in payload])
+        changed = []
+        for entry, current in zip(payload, existing):
+            current_value = current[0][0] if current and current[0] else ''
+            new_value = entry['values'][0][0]
+            if str(current_value) == str(new_value):
+                logger.debug("Cell %s already contains %s, skipping write", entry['range'], new_value)
+                continue
+            changed.append(entry)
+        payload = changed
+
+    if payload:
+        apply_batch_update(payload)
+    updates = len(payload)
     logger.info(f"Sheet update complete. {updates} cell(s) updated.")
+    if unmapped:
+        # Signal an incomplete update so the caller doesn't advance the
+        # incremental sync cursor past workouts that were never written
+        logger.warning("%d day(s) could not be written to the sheet.", unmapped)
+        return None
     return updates
 
 @main.command()
@@ -232,14 +422,32 @@ def update_running_sheet(sheet_name, creds_path, running_per_day):
 def sync(days_ago, sheet_name, creds_path, token_file):
     logger.info(f"Starting sync for {sheet_name} for the last {days_ago} days")
     access_token = get_valid_whoop_token(token_file=token_file)
+    sync_time = datetime.now(timezone.utc)
+    window_start = sync_time - timedelta(days=days_ago)
+
+    # Narrow the window to just what changed since the last successful sync,
+    # keeping a one-day overlap to catch workouts that arrived late. An
+    # explicit --days-ago is an intentional backfill, so only narrow when the
+    # option was left at its default.
+    days_ago_source = click.get_current_context().get_parameter_source('days_ago')
+    last_sync = _load_last_sync(sheet_name) if days_ago_source == click.core.ParameterSource.DEFAULT else None
+    if last_sync and last_sync - timedelta(days=1) > window_start:
+        window_start = last_sync - timedelta(days=1)
+        logger.info("Incremental sync: fetching from %s (last sync %s)", window_start, last_sync)
+
     # Use full ISO 8601 UTC date-time strings for WHOOP API
-    end_date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
-    start_date = (datetime.now(timezone.utc) - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    end_date = sync_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    start_date = window_start.strftime('%Y-%m-%dT%H:%M:%S.000Z')
     running_per_day = get_running_activities_with_token(access_token, start_date, end_date)
     if not running_per_day:
         logger.warning('No running workouts found in the given date range.')
+        _save_last_sync(sheet_name, sync_time)
         return
     updates = update_running_sheet(sheet_name, creds_path, running_per_day)
+    if updates is None:
+        logger.warning('Sheet update incomplete; keeping the previous sync state so missed workouts are retried next run.')
+        return
+    _save_last_sync(sheet_name, sync_time)
     logger.info(f"Updated {updates} running day(s) in the Running sheet.")
 
 @main.command(name='auth')
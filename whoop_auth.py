@@ -2,10 +2,17 @@ import os
 import json
 import logging
 import subprocess
+import time
 from dotenv import load_dotenv
 from flask import Flask, request, redirect
 from requests_oauthlib import OAuth2Session
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 load_dotenv()
 
 # Configure logging
@@ -26,7 +33,7 @@ def __get_whoop_token(token_file):
         )
         raise RuntimeError(f"{token_file} not found.")
     with open(token_file, "r") as f:
-        token = json.load(f)
+        token = _json_loads(f.read())
     return token
 
 
@@ -35,8 +42,18 @@ def __save_whoop_token(token, token_file):
         json.dump(token, f, indent=2)
 
 
+# Refresh when the token is within this many seconds of expiry, so the
+# refresh never races with an API call mid-run.
+TOKEN_EXPIRY_SKEW = 300
+
+
 def get_valid_whoop_token(token_file):
     token = __get_whoop_token(token_file)
+    # Skip the token-endpoint round-trip while the saved token is still
+    # comfortably within its lifetime.
+    if token.get("expires_at") and token["expires_at"] - TOKEN_EXPIRY_SKEW > time.time():
+        logger.info("WHOOP access token still valid, skipping refresh")
+        return token["access_token"]
     logger.info("Refreshing WHOOP access token...")
     extra = {
         "client_id": CLIENT_ID,
@@ -55,6 +72,9 @@ def get_valid_whoop_token(token_file):
         client_id=CLIENT_ID,
         client_secret=CLIENT_SECRET,
     )
+    # Persist an absolute expiry so the skew check above works on later runs.
+    if "expires_at" not in new_token and "expires_in" in new_token:
+        new_token["expires_at"] = time.time() + new_token["expires_in"]
     __save_whoop_token(new_token, token_file)
     logger.info(f"Refreshed token and saved to {token_file}")
     return new_token["access_token"]